@@ -1,68 +1,417 @@
+import json
 import logging
+import os
+import socket
+import stat
+import tempfile
 import time
 import datetime
+from dataclasses import dataclass
+from concurrent.futures import ThreadPoolExecutor, as_completed, wait
+from functools import lru_cache
+import numpy as np
 import yfinance as yf
 from PIL import Image, ImageDraw, ImageFont
 from plugins.base_plugin.base_plugin import BasePlugin
 
 logger = logging.getLogger(__name__)
 
+FONT_PATH_BOLD = "/usr/share/fonts/truetype/dejavu/DejaVuSans-Bold.ttf"
+FONT_PATH_REG = "/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf"
+
+# Fetched bars are cached on disk (in the plugin's private cache directory) for
+# slightly less than one bar interval, so renders triggered more often than
+# Yahoo updates don't refetch identical history. The live price is never cached.
+CACHE_TTL = {"1m": 55, "5m": 290, "15m": 880, "1d": 3500}
+
+# The display only uses a handful of colors, so draw into a "P" image with this
+# palette (white, black, blue, green, red) and expand to RGB once at the end
+PALETTE = [255, 255, 255, 0, 0, 0, 0, 0, 255, 0, 255, 0, 255, 0, 0]
+
+@dataclass(frozen=True)
+class LayoutSpec:
+    """Pixel positions, sizes and fonts for one display resolution."""
+    margin_x: int
+    margin_y: int
+    time_y: int
+    price_y: int
+    change_y: int
+    col_x_start: int
+    details_y_start: int
+    details_y_end: int
+    label_x: int
+    value_x: int
+    row_height: int
+    chart_x_start: int
+    chart_x_end: int
+    chart_y_start: int
+    chart_y_end: int
+    high_label_y: int
+    low_label_y: int
+    prev_label_x: int
+    line_width: int
+    dot_radius: int
+    font_error: ImageFont.FreeTypeFont
+    font_giant: ImageFont.FreeTypeFont
+    font_large: ImageFont.FreeTypeFont
+    font_med: ImageFont.FreeTypeFont
+    font_small: ImageFont.FreeTypeFont
+    font_tiny: ImageFont.FreeTypeFont
+
+def split_runs(xs, ys, y_base):
+    """Splits the chart line into runs above and below the baseline.
+
+    Returns a list of (is_up, polyline) tuples in drawing order. Points are
+    classified with a sign mask and runs are only broken where that mask
+    flips, at the interpolated crossing point which ends one run and starts
+    the next. Remember Y grows downwards, so y <= y_base means a higher price.
+    """
+    sign = (ys <= y_base).astype(np.int8)
+    crossings = np.flatnonzero(np.diff(sign))
+
+    # The sign flips across each crossing, so ys[i] != ys[i + 1] there
+    x1, x2 = xs[crossings], xs[crossings + 1]
+    y1, y2 = ys[crossings], ys[crossings + 1]
+    x_cross = x1 + (x2 - x1) * (y_base - y1) / (y2 - y1)
+
+    points = np.column_stack((xs, ys)).tolist()
+    runs = []
+    start = 0
+    head = []
+    for i, x in zip(crossings.tolist(), x_cross.tolist()):
+        cross = [x, y_base]
+        runs.append((bool(sign[start]), head + points[start:i + 1] + [cross]))
+        head = [cross]
+        start = i + 1
+    runs.append((bool(sign[start]), head + points[start:]))
+    return runs
+
+def draw_segments(buf, starts, ends):
+    """Plots 1px line segments into a boolean framebuffer.
+
+    starts and ends are (n, 2) arrays of (x, y) endpoints, which are snapped
+    to whole pixels like ImageDraw does. Every segment is sampled once per
+    pixel along its major axis (a DDA, equivalent to Bresenham for integer
+    endpoints) and all samples are written with a single indexed assignment,
+    instead of one Python-to-C draw call per line.
+    """
+    if len(starts) == 0:
+        return
+    starts = np.floor(starts)
+    deltas = np.floor(ends) - starts
+    steps = np.abs(deltas).max(axis=1).astype(np.intp) + 1
+
+    segment = np.repeat(np.arange(len(starts)), steps)
+    offset = np.arange(steps.sum()) - np.repeat(np.cumsum(steps) - steps, steps)
+    t = offset / np.maximum(steps - 1, 1)[segment]
+
+    px = np.rint(starts[segment, 0] + deltas[segment, 0] * t).astype(np.intp)
+    py = np.rint(starts[segment, 1] + deltas[segment, 1] * t).astype(np.intp)
+    inside = (px >= 0) & (px < buf.shape[1]) & (py >= 0) & (py < buf.shape[0])
+    buf[py[inside], px[inside]] = True
+
+def dilate(buf, size):
+    """Thickens the strokes in a boolean framebuffer to size pixels.
+
+    The square dilation is done separably by OR-ing size shifted slices along
+    each axis, covering offsets -(size // 2) to (size - 1) // 2 so even widths
+    stay exact.
+    """
+    lo = -(size // 2)
+    rows = np.zeros_like(buf)
+    for d in range(lo, lo + size):
+        if d >= 0:
+            rows[:, d:] |= buf[:, :buf.shape[1] - d]
+        else:
+            rows[:, :d] |= buf[:, -d:]
+
+    out = np.zeros_like(buf)
+    for d in range(lo, lo + size):
+        if d >= 0:
+            out[d:] |= rows[:buf.shape[0] - d]
+        else:
+            out[:d] |= rows[-d:]
+    return out
+
 class Stock(BasePlugin):
+    # Per-ticker circuit breaker: ticker -> (consecutive failures, monotonic time of last failure)
+    _breaker: dict[str, tuple[int, float]] = {}
+    BREAKER_THRESHOLD = 3
+    BREAKER_COOLDOWN = 60
+
     def __init__(self, config, **dependencies):
         super().__init__(config, **dependencies)
         self.retries = 3
-        self.retry_delay = 5
+        self.retry_delay = 1
+        self.hedge_delay = 5
+        self.fetch_timeout = 30
+        # Smoothed duration of successful fetches, used to time the hedge request
+        self._fetch_latency = None
+        self._executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="stock-fetch")
+        # Last formatted timestamp and the epoch minute it was formatted in
+        self._last_minute = None
+        self._last_time_str = None
+        # Pre-rasterized 1-bit glyphs: (font, char) -> (mask, offset, advance)
+        self._atlas = {}
 
     def generate_settings_template(self):
         template_params = super().generate_settings_template()
         # Add any dynamic template variables here if needed
         return template_params
 
+    @staticmethod
+    @lru_cache(maxsize=64)
+    def _font(path, size):
+        """Loads a TrueType font once per (path, size), falling back to the default font."""
+        try:
+            return ImageFont.truetype(path, size)
+        except OSError:
+            return ImageFont.load_default()
+
+    @staticmethod
+    @lru_cache(maxsize=8)
+    def _layout(width, height):
+        """Computes the layout for a resolution once; it only depends on (width, height)."""
+        col_x_start = int(width * 0.625) # approx 500 for 800 width
+        chart_x_end = width - int(width * 0.03)
+        chart_y_start = int(height * 0.625)
+        chart_y_end = height - int(height * 0.08)
+        return LayoutSpec(
+            margin_x=int(width * 0.025),
+            margin_y=int(height * 0.04),
+            time_y=int(height * 0.06),
+            price_y=int(height * 0.20),
+            change_y=int(height * 0.45),
+            col_x_start=col_x_start,
+            details_y_start=int(height * 0.18),
+            details_y_end=int(height * 0.58),
+            label_x=col_x_start + int(width * 0.025),
+            value_x=col_x_start + int(width * 0.175),
+            row_height=int(height * 0.10),
+            chart_x_start=int(width * 0.03),
+            chart_x_end=chart_x_end,
+            chart_y_start=chart_y_start,
+            chart_y_end=chart_y_end,
+            high_label_y=chart_y_start - int(height * 0.05),
+            low_label_y=chart_y_end + 5,
+            prev_label_x=chart_x_end - int(width * 0.075),
+            line_width=max(2, int(width * 0.005)),
+            dot_radius=max(4, int(width * 0.01)),
+            # Fonts - Scale based on height
+            font_error=Stock._font(FONT_PATH_BOLD, int(height * 0.08)),
+            font_giant=Stock._font(FONT_PATH_BOLD, int(height * 0.20)), # 100/480 ~= 0.2
+            font_large=Stock._font(FONT_PATH_BOLD, int(height * 0.125)), # 60/480 ~= 0.125
+            font_med=Stock._font(FONT_PATH_REG, int(height * 0.06)), # 30/480 ~= 0.06
+            font_small=Stock._font(FONT_PATH_REG, int(height * 0.04)), # 20/480 ~= 0.04
+            font_tiny=Stock._font(FONT_PATH_REG, int(height * 0.033)), # 16/480 ~= 0.033
+        )
+
+    def _glyph(self, font, char):
+        """Returns the cached (mask, offset, advance) for a character, rasterizing it on first use.
+
+        Masks are 1-bit, matching how ImageDraw renders text onto palette images.
+        """
+        key = (font, char)
+        glyph = self._atlas.get(key)
+        if glyph is None:
+            left, top, right, bottom = font.getbbox(char)
+            mask = None
+            if right > left and bottom > top:
+                mask = Image.new("1", (right - left, bottom - top), 0)
+                ImageDraw.Draw(mask).text((-left, -top), char, fill=255, font=font)
+            glyph = self._atlas[key] = (mask, (left, top), font.getlength(char))
+        return glyph
+
+    def _draw_text(self, image, xy, text, font, fill):
+        """Draws text by blitting cached glyph masks instead of rasterizing it through FreeType."""
+        x, y = xy
+        for char in text:
+            mask, (dx, dy), advance = self._glyph(font, char)
+            if mask is not None:
+                image.paste(fill, (round(x + dx), round(y + dy)), mask)
+            x += advance
+
+    def _text_width(self, font, text):
+        """Measures text as the sum of the cached glyph advances, matching _draw_text."""
+        return sum(self._glyph(font, char)[2] for char in text)
+
+    def _fetch(self, ticker, period, interval):
+        """Fetches the live price and the (possibly cached) session bars for a ticker in a single attempt."""
+        stock = yf.Ticker(ticker)
+
+        # fast_info is reliable on Pi, and always fetched so the price is current
+        current_price = stock.fast_info.last_price
+        prev_close = stock.fast_info.previous_close
+
+        bars = self._load_cached(ticker, period, interval)
+        if bars is None:
+            bars = self._fetch_bars(stock, period, interval)
+            self._save_cached(ticker, period, interval, bars)
+        else:
+            logger.info(f"Using cached history for {ticker}")
+
+        return {"price": current_price, "prev_close": prev_close, **bars}
+
+    def _fetch_bars(self, stock, period, interval):
+        """Fetches the history and derives the session's OHLCV from it."""
+        hist = stock.history(period=period, interval=interval)
+
+        # Derive the session's OHLCV from the history rather than making a
+        # separate (slow) request for stock.info. The columns are pulled into
+        # one ndarray up front to skip pandas indexing for each lookup.
+        if hist.empty:
+            ohlcv = np.empty((0, 5))
+        else:
+            ohlcv = hist[["Open", "High", "Low", "Close", "Volume"]].to_numpy(dtype=np.float64)
+
+        # yfinance only drops bars that are entirely NaN, so skip missing
+        # values per column like the pandas reductions do
+        opens, highs, lows, closes, volumes = (column[~np.isnan(column)] for column in ohlcv.T)
+        d_open = float(opens[0]) if len(opens) else 0.0
+        d_high = float(highs.max()) if len(highs) else 0.0
+        d_low = float(lows.min()) if len(lows) else 0.0
+        d_vol = int(volumes.sum())
+
+        return {
+            "open": d_open,
+            "high": d_high,
+            "low": d_low,
+            "volume": d_vol,
+            "history": closes
+        }
+
+    def _cache_dir(self):
+        """Returns the cache directory, or None if it is not private to this user."""
+        path = self.get_plugin_dir("cache")
+        os.makedirs(path, mode=0o700, exist_ok=True)
+        st = os.lstat(path)
+        if not stat.S_ISDIR(st.st_mode) or st.st_uid != os.getuid() or st.st_mode & 0o077:
+            logger.warning(f"Not using stock cache at {path}: it must be a directory owned by this user with mode 0700")
+            return None
+        return path
+
+    def _cache_path(self, ticker, period, interval):
+        cache_dir = self._cache_dir()
+        if cache_dir is None:
+            return None
+        key = f"{ticker}:{period}:{interval}".replace(os.sep, "_")
+        return os.path.join(cache_dir, f"{key}.json")
+
+    def _load_cached(self, ticker, period, interval):
+        """Returns cached bars for the request if they are younger than the interval's TTL."""
+        if interval not in CACHE_TTL:
+            return None
+        try:
+            path = self._cache_path(ticker, period, interval)
+            if path is None:
+                return None
+            # A Pi has no RTC, so the clock can step backwards; treat that as stale
+            age = time.time() - os.path.getmtime(path)
+            if not 0 <= age < CACHE_TTL[interval]:
+                return None
+            with open(path) as f:
+                data = json.load(f)
+            data["history"] = np.asarray(data["history"], dtype=np.float64)
+            return data
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            logger.warning(f"Failed to read cached data for {ticker}: {e}")
+            return None
+
+    def _save_cached(self, ticker, period, interval, data):
+        if interval not in CACHE_TTL:
+            return
+        try:
+            path = self._cache_path(ticker, period, interval)
+            if path is None:
+                return
+            # A hedged duplicate fetch may write concurrently, so use a unique temp file
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+            with os.fdopen(fd, "w") as f:
+                json.dump({**data, "history": np.asarray(data["history"]).tolist()}, f)
+            os.replace(tmp_path, path)
+        except Exception as e:
+            logger.warning(f"Failed to cache data for {ticker}: {e}")
+
+    @staticmethod
+    def _is_fatal(error):
+        """Returns True for errors that retrying cannot fix (client errors, DNS failures)."""
+        status = getattr(getattr(error, "response", None), "status_code", None)
+        if status is not None and 400 <= status < 500 and status not in (408, 429):
+            return True
+        while error is not None:
+            if isinstance(error, socket.gaierror):
+                return True
+            error = error.__cause__ or error.__context__
+        return False
+
+    def _timed_fetch(self, ticker, period, interval):
+        """Runs _fetch and folds its duration into the smoothed fetch latency."""
+        start = time.monotonic()
+        data = self._fetch(ticker, period, interval)
+        elapsed = time.monotonic() - start
+        if self._fetch_latency is None:
+            self._fetch_latency = elapsed
+        else:
+            self._fetch_latency = 0.8 * self._fetch_latency + 0.2 * elapsed
+        return data
+
+    def _hedge_after(self):
+        """Seconds to wait before hedging, or None until a fetch latency has been observed."""
+        if self._fetch_latency is None:
+            return None
+        return max(self.hedge_delay, 3 * self._fetch_latency)
+
     def get_stock_data(self, ticker, period, interval):
-        """Fetches price and history from Yahoo Finance with retries"""
+        """Fetches price and history from Yahoo Finance with hedged retries.
+
+        If the first request is still running well past the usual fetch time
+        (three times the observed latency, at least hedge_delay seconds) a
+        second, identical request is started and whichever succeeds first is
+        used. Failed attempts back off exponentially, unrecoverable errors are
+        not retried, and a ticker that keeps failing is skipped for
+        BREAKER_COOLDOWN seconds. The history bars are cached on disk for the
+        interval's CACHE_TTL; the price is fetched on every call.
+        """
+        failures, last_fail = self._breaker.get(ticker, (0, 0.0))
+        if failures >= self.BREAKER_THRESHOLD and time.monotonic() - last_fail < self.BREAKER_COOLDOWN:
+            logger.warning(f"Skipping fetch for {ticker}: {failures} consecutive failures")
+            return None
+
         for attempt in range(self.retries):
+            futures = [self._executor.submit(self._timed_fetch, ticker, period, interval)]
             try:
-                stock = yf.Ticker(ticker)
-
-                # fast_info is reliable on Pi
-                current_price = stock.fast_info.last_price
-                prev_close = stock.fast_info.previous_close
-
-                # Fetch history
-                hist = stock.history(period=period, interval=interval)
-
-                try:
-                    info = stock.info
-                    d_open = info.get('open', 0.0)
-                    d_high = info.get('dayHigh', 0.0)
-                    d_low = info.get('dayLow', 0.0)
-                    d_vol = info.get('volume', 0)
-                except:
-                    d_open = hist['Open'].iloc[-1] if not hist.empty else 0.0
-                    d_high = hist['High'].max() if not hist.empty else 0.0
-                    d_low = hist['Low'].min() if not hist.empty else 0.0
-                    d_vol = hist['Volume'].sum() if not hist.empty else 0
-
-                return {
-                    "price": current_price,
-                    "prev_close": prev_close,
-                    "open": d_open,
-                    "high": d_high,
-                    "low": d_low,
-                    "volume": d_vol,
-                    "history": hist['Close'].tolist()
-                }
+                hedge_after = self._hedge_after()
+                if hedge_after is not None:
+                    done, _ = wait(futures, timeout=hedge_after)
+                    if not done:
+                        futures.append(self._executor.submit(self._timed_fetch, ticker, period, interval))
+
+                error = None
+                for future in as_completed(futures, timeout=self.fetch_timeout):
+                    try:
+                        data = future.result()
+                        self._breaker.pop(ticker, None)
+                        return data
+                    except Exception as e:
+                        error = e
+                raise error
             except Exception as e:
                 logger.error(f"Attempt {attempt + 1}/{self.retries} failed: {e}")
-                time.sleep(self.retry_delay)
-
+                if self._is_fatal(e):
+                    break
+                if attempt < self.retries - 1:
+                    time.sleep(self.retry_delay * 2 ** attempt)
+            finally:
+                # Drop requests that are still queued; a straggler that is
+                # already running finishes in the background and is discarded
+                for future in futures:
+                    future.cancel()
+
+        self._breaker[ticker] = (failures + 1, time.monotonic())
         return None
 
-    def map_range(self, value, in_min, in_max, out_min, out_max):
-        if in_max == in_min:
-            return (out_min + out_max) / 2
-        return (value - in_min) * (out_max - out_min) / (in_max - in_min) + out_min
-
     def generate_image(self, settings, device_config):
         ticker = settings.get("ticker", "TSLA")
         period = settings.get("period", "1d")
@@ -77,26 +426,24 @@ class Stock(BasePlugin):
             dimensions = dimensions[::-1]
         width, height = dimensions
         
-        # Colors
-        c_bg = (255, 255, 255) # White
-        c_text_main = (0, 0, 0) # Black
-        c_dim = (0, 0, 0) # Black
-        c_grid = (0, 0, 255) # Blue
-        c_up = (0, 255, 0) # Green
-        c_down = (255, 0, 0) # Red
-
-        image = Image.new("RGB", (width, height), c_bg)
+        # Colors - indices into PALETTE
+        c_bg = 0 # White
+        c_text_main = 1 # Black
+        c_dim = 1 # Black
+        c_grid = 2 # Blue
+        c_up = 3 # Green
+        c_down = 4 # Red
+
+        image = Image.new("P", (width, height), c_bg)
+        image.putpalette(PALETTE + [0] * (256 * 3 - len(PALETTE)))
         draw = ImageDraw.Draw(image)
-        
+        layout = self._layout(width, height)
+
         if not data:
             logger.error("Failed to fetch data.")
             # Draw error message
-            try:
-                font_error = ImageFont.truetype("/usr/share/fonts/truetype/dejavu/DejaVuSans-Bold.ttf", int(height * 0.08))
-            except OSError:
-                font_error = ImageFont.load_default()
-            draw.text((20, height // 2), f"Failed to fetch data for {ticker}", fill=c_down, font=font_error)
-            return image
+            draw.text((20, height // 2), f"Failed to fetch data for {ticker}", fill=c_down, font=layout.font_error)
+            return image.convert("RGB")
 
         current_price = data['price']
         prev_close = data['prev_close']
@@ -107,56 +454,31 @@ class Stock(BasePlugin):
         is_bullish = change_amt >= 0
         c_accent = c_up if is_bullish else c_down
 
-        # Fonts - Scale based on height
-        font_path_bold = "/usr/share/fonts/truetype/dejavu/DejaVuSans-Bold.ttf"
-        font_path_reg = "/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf"
-
-        try:
-            font_giant = ImageFont.truetype(font_path_bold, int(height * 0.20)) # 100/480 ~= 0.2
-            font_large = ImageFont.truetype(font_path_bold, int(height * 0.125)) # 60/480 ~= 0.125
-            font_med = ImageFont.truetype(font_path_reg, int(height * 0.06)) # 30/480 ~= 0.06
-            font_small = ImageFont.truetype(font_path_reg, int(height * 0.04)) # 20/480 ~= 0.04
-            font_tiny = ImageFont.truetype(font_path_reg, int(height * 0.033)) # 16/480 ~= 0.033
-        except OSError:
-            # Fallback if fonts are missing
-            font_giant = font_large = font_med = font_small = font_tiny = ImageFont.load_default()
-
         # 5. DRAW UI
 
-        # Margins
-        margin_x = int(width * 0.025)
-        margin_y = int(height * 0.04)
-
         # -- HEADER --
-        draw.text((margin_x, margin_y), ticker, fill=c_text_main, font=font_large)
+        draw.text((layout.margin_x, layout.margin_y), ticker, fill=c_text_main, font=layout.font_large)
 
-        # Timestamp (Right Aligned)
-        now_str = datetime.datetime.now().strftime("%a %H:%M")
-        try:
-            time_width = font_med.getlength(now_str)
-        except AttributeError:
-            time_width = font_med.getsize(now_str)[0]
-        time_x = width - time_width - margin_x
-        draw.text((time_x, int(height * 0.06)), now_str, fill=c_dim, font=font_med)
+        # Timestamp (Right Aligned), only reformatted when the minute changes
+        minute = int(time.time() // 60)
+        if minute != self._last_minute:
+            self._last_minute = minute
+            self._last_time_str = datetime.datetime.now().strftime("%a %H:%M")
+        now_str = self._last_time_str
+        time_x = width - self._text_width(layout.font_med, now_str) - layout.margin_x
+        draw.text((time_x, layout.time_y), now_str, fill=c_dim, font=layout.font_med)
 
         # Current Price
         price_str = f"${current_price:,.2f}"
-        price_y = int(height * 0.20)
-        draw.text((margin_x, price_y), price_str, fill=c_text_main, font=font_giant)
+        self._draw_text(image, (layout.margin_x, layout.price_y), price_str, layout.font_giant, c_text_main)
 
         # Change %
         sign = "+" if is_bullish else ""
         change_str = f"{sign}{change_amt:.2f} ({sign}{change_pct:.2f}%)"
-        change_y = int(height * 0.45)
-        draw.text((margin_x, change_y), change_str, fill=c_accent, font=font_med)
+        self._draw_text(image, (layout.margin_x, layout.change_y), change_str, layout.font_med, c_accent)
 
         # -- DETAILS COLUMN (Right Side) --
-        # Adjust layout based on width
-        col_x_start = int(width * 0.625) # approx 500 for 800 width
-        details_y_start = int(height * 0.18)
-        details_y_end = int(height * 0.58)
-        
-        draw.line([(col_x_start, details_y_start), (col_x_start, details_y_end)], fill=c_grid, width=3)
+        draw.line([(layout.col_x_start, layout.details_y_start), (layout.col_x_start, layout.details_y_end)], fill=c_grid, width=3)
 
         labels = [
             ("Open", f"${data['open']:.2f}"),
@@ -165,96 +487,79 @@ class Stock(BasePlugin):
             ("Vol", f"{data['volume'] / 1000000:.1f}M"),
         ]
 
-        start_y = details_y_start
-        label_x = col_x_start + int(width * 0.025)
-        value_x = col_x_start + int(width * 0.175)
-        row_height = int(height * 0.10)
-        
+        start_y = layout.details_y_start
         for label, value in labels:
-            draw.text((label_x, start_y), label, fill=c_dim, font=font_med)
-            draw.text((value_x, start_y), value, fill=c_text_main, font=font_med)
-            start_y += row_height
+            draw.text((layout.label_x, start_y), label, fill=c_dim, font=layout.font_med)
+            self._draw_text(image, (layout.value_x, start_y), value, layout.font_med, c_text_main)
+            start_y += layout.row_height
 
         # -- DYNAMIC SPLIT CHART (Bottom Section) --
-        chart_x_start = int(width * 0.03)
-        chart_x_end = width - int(width * 0.03)
-        chart_y_start = int(height * 0.625)
-        chart_y_end = height - int(height * 0.08)
+        chart_x_start, chart_x_end = layout.chart_x_start, layout.chart_x_end
+        chart_y_start, chart_y_end = layout.chart_y_start, layout.chart_y_end
 
-        history = data['history']
+        # Drop missing bars, which would otherwise poison the projected
+        # coordinates and the rasterization below
+        hist = np.asarray(data['history'], dtype=np.float64)
+        hist = hist[np.isfinite(hist)]
 
-        if len(history) > 1:
+        if len(hist) > 1:
             # Determine strict range including prev_close so the baseline is always visible/relevant
-            min_p = min(min(history), prev_close)
-            max_p = max(max(history), prev_close)
+            min_p = min(float(hist.min()), prev_close)
+            max_p = max(float(hist.max()), prev_close)
 
             # Min/Max Labels
-            draw.text((chart_x_start, chart_y_start - int(height * 0.05)), f"High: {max_p:.2f}", fill=c_grid, font=font_small)
-            draw.text((chart_x_start, chart_y_end + 5), f"Low: {min_p:.2f}", fill=c_grid, font=font_small)
-
-            # Calculate the Y-coordinate for the "Zero Line" (Previous Close)
-            y_base = self.map_range(prev_close, min_p, max_p, chart_y_end, chart_y_start)
-
-            # Draw the dashed/solid baseline
-            draw.line([(chart_x_start, y_base), (chart_x_end, y_base)], fill=c_grid, width=2)
-            draw.text((chart_x_end - int(width * 0.075), y_base - 20), "Prev", fill=c_grid, font=font_tiny)
-
-            # Pre-calculate all points
-            points = []
-            for i, price in enumerate(history):
-                x = self.map_range(i, 0, len(history) - 1, chart_x_start, chart_x_end)
-                y = self.map_range(price, min_p, max_p, chart_y_end, chart_y_start)
-                points.append((x, y))
-
-            # --- DRAW SEGMENTS WITH COLOR SPLIT ---
-            line_width = max(2, int(width * 0.005))
-
-            for i in range(len(points) - 1):
-                x1, y1 = points[i]
-                x2, y2 = points[i + 1]
-
-                # Remember: Y grows downwards.
-                # y < y_base means "Higher Price" (Green)
-                # y > y_base means "Lower Price" (Red)
-
-                if y1 <= y_base and y2 <= y_base:
-                    # Entirely bullish segment
-                    draw.line([(x1, y1), (x2, y2)], fill=c_up, width=line_width)
-
-                elif y1 >= y_base and y2 >= y_base:
-                    # Entirely bearish segment
-                    draw.line([(x1, y1), (x2, y2)], fill=c_down, width=line_width)
-
-                else:
-                    # SPLIT CASE: The line crosses the baseline.
-                    # We need to find the intersection point.
-                    # Linear interpolation to find x where y = y_base
-
-                    # Avoid division by zero
-                    if y2 != y1:
-                        ratio = (y_base - y1) / (y2 - y1)
-                        x_cross = x1 + (x2 - x1) * ratio
-                        y_cross = y_base
-                    else:
-                        x_cross = x1  # Should not happen in this else block
-                        y_cross = y1
-
-                    # Color logic for first half
-                    color_1 = c_up if y1 < y_base else c_down
-                    # Color logic for second half
-                    color_2 = c_up if y2 < y_base else c_down
-
-                    draw.line([(x1, y1), (x_cross, y_cross)], fill=color_1, width=line_width)
-                    draw.line([(x_cross, y_cross), (x2, y2)], fill=color_2, width=line_width)
+            draw.text((chart_x_start, layout.high_label_y), f"High: {max_p:.2f}", fill=c_grid, font=layout.font_small)
+            draw.text((chart_x_start, layout.low_label_y), f"Low: {min_p:.2f}", fill=c_grid, font=layout.font_small)
+
+            if max_p == min_p:
+                # Flat history (pre-market, holiday, illiquid ticker): every
+                # point and the previous close sit on the midline, so draw it
+                # as one line covering the baseline
+                y_base = (chart_y_start + chart_y_end) / 2
+                draw.line([(chart_x_start, y_base), (chart_x_end, y_base)], fill=c_dim, width=layout.line_width)
+                last_pt = (chart_x_end, y_base)
+            else:
+                # Calculate the Y-coordinate for the "Zero Line" (Previous Close)
+                y_base = chart_y_end - (prev_close - min_p) * (chart_y_end - chart_y_start) / (max_p - min_p)
+
+                # Draw the dashed/solid baseline
+                draw.line([(chart_x_start, y_base), (chart_x_end, y_base)], fill=c_grid, width=2)
+
+                # Pre-calculate all points in one vectorized pass
+                xs = np.linspace(chart_x_start, chart_x_end, len(hist))
+                ys = chart_y_end - (hist - min_p) * (chart_y_end - chart_y_start) / (max_p - min_p)
+
+                # --- DRAW SEGMENTS WITH COLOR SPLIT ---
+                # Thick lines are rasterized as a polygon per segment, so plot each
+                # color's runs 1px wide into a NumPy framebuffer covering just the
+                # chart area, thicken it by OR-ing shifted slices and paste it in
+                pad = layout.line_width
+                left, top = chart_x_start - pad, chart_y_start - pad
+                line_shape = (chart_y_end - chart_y_start + 2 * pad + 1, chart_x_end - chart_x_start + 2 * pad + 1)
+                segments = {c_up: [], c_down: []}
+
+                for is_up, polyline in split_runs(xs - left, ys - top, y_base - top):
+                    segments[c_up if is_up else c_down].append(np.asarray(polyline))
+
+                for color, runs in segments.items():
+                    buf = np.zeros(line_shape, dtype=bool)
+                    if runs:
+                        draw_segments(buf,
+                                      np.concatenate([run[:-1] for run in runs]),
+                                      np.concatenate([run[1:] for run in runs]))
+                    line_mask = Image.fromarray(dilate(buf, layout.line_width))
+                    image.paste(color, (left, top), line_mask)
+                last_pt = (xs[-1], ys[-1])
+
+            draw.text((layout.prev_label_x, y_base - 20), "Prev", fill=c_grid, font=layout.font_tiny)
 
             # Sparkline dot at the end
-            last_pt = points[-1]
-            last_price = history[-1]
+            last_price = hist[-1]
 
             # Dot color matches the end state
             dot_color = c_up if last_price >= prev_close else c_down
 
-            r = max(4, int(width * 0.01))
+            r = layout.dot_radius
             draw.ellipse((last_pt[0] - r, last_pt[1] - r, last_pt[0] + r, last_pt[1] + r), fill=dot_color)
 
-        return image
+        return image.convert("RGB")
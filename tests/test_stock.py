@@ -0,0 +1,110 @@
+import sys
+from pathlib import Path
+
+import numpy as np
+import pytest
+from PIL import Image, ImageDraw
+
+pytest.importorskip("yfinance")
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "src"))
+
+from plugins.stock.stock import dilate, draw_segments, split_runs
+
+
+class TestSplitRuns:
+
+    def test_crossing_and_touching_baseline(self):
+        # y_base = 10, y <= 10 is "up"; crosses down, back up to touch the baseline, then rises
+        xs = np.array([0.0, 1.0, 2.0, 3.0, 4.0])
+        ys = np.array([8.0, 12.0, 12.0, 10.0, 8.0])
+
+        runs = split_runs(xs, ys, 10.0)
+
+        assert runs == [
+            (True, [[0.0, 8.0], [0.5, 10.0]]),
+            (False, [[0.5, 10.0], [1.0, 12.0], [2.0, 12.0], [3.0, 10.0]]),
+            (True, [[3.0, 10.0], [3.0, 10.0], [4.0, 8.0]]),
+        ]
+
+    def test_touching_from_above_stays_one_run(self):
+        xs = np.array([0.0, 1.0, 2.0])
+        ys = np.array([8.0, 10.0, 8.0])
+
+        assert split_runs(xs, ys, 10.0) == [(True, [[0.0, 8.0], [1.0, 10.0], [2.0, 8.0]])]
+
+    def test_entirely_below_baseline(self):
+        xs = np.array([0.0, 1.0, 2.0])
+        ys = np.array([11.0, 15.0, 12.0])
+
+        assert split_runs(xs, ys, 10.0) == [(False, [[0.0, 11.0], [1.0, 15.0], [2.0, 12.0]])]
+
+
+class TestDrawSegments:
+
+    @pytest.mark.parametrize(
+        "segment",
+        [
+            (0, 5, 19, 5),    # horizontal
+            (7, 0, 7, 19),    # vertical
+            (0, 0, 19, 19),   # diagonal
+            (19, 0, 0, 19),   # anti-diagonal
+            (0, 0, 19, 4),    # shallow
+            (2, 1, 5, 18),    # steep
+            (15, 17, 3, 2),   # right-to-left
+            (4, 4, 4, 4),     # single point
+        ]
+    )
+    def test_matches_imagedraw_line(self, segment):
+        expected = Image.new("1", (20, 20), 0)
+        ImageDraw.Draw(expected).line(segment, fill=1, width=1)
+
+        buf = np.zeros((20, 20), dtype=bool)
+        draw_segments(buf, np.array([segment[:2]], dtype=np.float64), np.array([segment[2:]], dtype=np.float64))
+
+        assert np.array_equal(buf, np.array(expected))
+
+    def test_draws_several_segments_and_clips(self):
+        buf = np.zeros((10, 10), dtype=bool)
+        starts = np.array([[0.0, 0.0], [5.0, 5.0]])
+        ends = np.array([[9.0, 0.0], [15.0, 5.0]])
+
+        draw_segments(buf, starts, ends)
+
+        assert buf[0].all()
+        assert buf[5, 5:].all() and not buf[5, :5].any()
+        assert buf.sum() == 15
+
+    def test_no_segments(self):
+        buf = np.zeros((5, 5), dtype=bool)
+        draw_segments(buf, np.empty((0, 2)), np.empty((0, 2)))
+        assert not buf.any()
+
+
+class TestDilate:
+
+    @pytest.mark.parametrize(
+        "size,rows,cols",
+        [
+            (1, slice(5, 6), slice(5, 6)),
+            (2, slice(4, 6), slice(4, 6)),
+            (3, slice(4, 7), slice(4, 7)),
+            (4, slice(3, 7), slice(3, 7)),
+        ]
+    )
+    def test_single_pixel_becomes_size_square(self, size, rows, cols):
+        buf = np.zeros((11, 11), dtype=bool)
+        buf[5, 5] = True
+
+        expected = np.zeros_like(buf)
+        expected[rows, cols] = True
+
+        assert np.array_equal(dilate(buf, size), expected)
+
+    def test_horizontal_line_is_size_pixels_thick(self):
+        buf = np.zeros((11, 20), dtype=bool)
+        buf[5, 2:18] = True
+
+        out = dilate(buf, 4)
+
+        assert np.array_equal(np.flatnonzero(out[:, 10]), [3, 4, 5, 6])
+        assert not buf[:, 0].any() and out[5, 0]